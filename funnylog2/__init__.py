@@ -4,27 +4,66 @@
 # SPDX-FileCopyrightText: 2023 UnionTech Software Technology Co., Ltd.
 
 # SPDX-License-Identifier: Apache Software License
+import atexit
+import importlib.util
 import inspect
 import logging
 import os
+import queue
 import re
 import sys
 import threading
 import time
-import weakref
+from logging.handlers import QueueHandler
+from logging.handlers import QueueListener
+from functools import lru_cache
+from pathlib import Path
+from types import FunctionType
 from functools import wraps
 
-try:
-    from allure_commons._allure import StepContext
-    from allure_commons.utils import func_parameters
-    from allure_commons.utils import represent
+# allure_commons 导入链很重（attrs、pytest插件等），只探测是否可用，真正导入推迟到首次使用
+ALLURE_STEP = (
+        os.environ.get("FUNNYLOG2_ALLURE", "1") == "1"
+        and importlib.util.find_spec("allure_commons") is not None
+)
+
+StepContext = None
+func_parameters = None
+represent = None
+
+
+def _load_allure():
+    """首次用到 allure 步骤时才导入相关符号，并缓存为模块全局"""
+    global StepContext, func_parameters, represent
+    if StepContext is None:
+        from allure_commons._allure import StepContext as _step_context
+        from allure_commons.utils import func_parameters as _func_parameters
+        from allure_commons.utils import represent as _represent
+
+        StepContext = _step_context
+        func_parameters = _func_parameters
+        represent = _represent
 
-    ALLURE_STEP = True
-except ModuleNotFoundError:
-    ALLURE_STEP = False
 
 from funnylog2.config import config
 
+# 热路径上的正则统一预编译，省掉每次调用的缓存查找
+_COLOR_RE = re.compile(r"(\[[a-zA-Z_]*?])?(.+)")
+_DOC_SPLIT_RE = re.compile(r":param|@param|@return|:return")
+_IP_RE = re.compile(r"\d+\.\d+\.\d+\.(\d+)")
+
+# 日志句柄是否已初始化，省掉每条日志对 root handlers 的长度检查
+_initialized = False
+
+
+def _ensure_initialized():
+    """首次日志调用时初始化句柄；用户已自行配置过 root 则原样保留"""
+    global _initialized
+    if logging.root.handlers:
+        _initialized = True
+    else:
+        logger(config.LOG_LEVEL)
+
 
 class Singleton(type):
     """单例模式"""
@@ -33,25 +72,25 @@ class Singleton(type):
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        Singleton.__instance = None
-        # 初始化存放实例地址
-        self._cache = weakref.WeakValueDictionary()
+        # 初始化存放实例地址，普通 dict 持强引用保证实例不被回收
+        self._cache = {}
 
     def __call__(self, *args, **kwargs):
-        # 提取类初始化时的参数
-        kargs = "".join([f"{key}" for key in args]) if args else ""
-        kkwargs = "".join([f"{key}" for key in kwargs]) if kwargs else ""
-        # 判断相同参数的实例师否被创建
-        if kargs + kkwargs not in self._cache:  # 存在则从内存地址中取实例
-            with Singleton._instance_lock:
-                Singleton.__instance = super().__call__(*args, **kwargs)
-                self._cache[kargs + kkwargs] = Singleton.__instance
-        # 不存在则新建实例
-        else:
-            Singleton.__instance = self._cache[kargs + kkwargs]
-        return Singleton.__instance
+        # 以初始化参数的元组作缓存键，哈希走C层且不会像拼接字符串那样产生碰撞
+        key = (args, tuple(sorted(kwargs.items())))
+        # 双重检查锁：命中缓存时完全不加锁，只有首次创建才进临界区
+        inst = self._cache.get(key)
+        if inst is not None:
+            return inst
+        with Singleton._instance_lock:
+            inst = self._cache.get(key)
+            if inst is None:
+                inst = super().__call__(*args, **kwargs)
+                self._cache[key] = inst
+            return inst
 
 
+@lru_cache(maxsize=None)
 def is_static_method(klass_or_instance, attr: str):
     """Test if a value of a class is static method.
     example::
@@ -64,102 +103,126 @@ def is_static_method(klass_or_instance, attr: str):
     """
     if attr.startswith("_"):
         return False
-    value = getattr(klass_or_instance, attr)
+    value = getattr(klass_or_instance, attr, None)
     # is a function or method
-    if inspect.isroutine(value):
-        if isinstance(value, property):
-            return False
-        args = []
-        for param in inspect.signature(value).parameters.values():
-            kind = param.kind
-            name = param.name
-            if kind is inspect._ParameterKind.POSITIONAL_ONLY:
-                args.append(name)
-            elif kind is inspect._ParameterKind.POSITIONAL_OR_KEYWORD:
-                args.append(name)
-        # Can't be a regular method, must be a static method
-        if len(args) == 0:
-            return True
-        # must be a regular method
-        if args[0] == "self":
-            return False
+    if value is None or not inspect.isroutine(value):
+        return False
+    # 装饰器包装过的方法要先取回原函数，否则 co_varnames 看到的是 (*a, **kw)
+    value = inspect.unwrap(value)
+    # 直接读 __code__ 上的参数信息，省掉 inspect.signature 的完整解析
+    code = getattr(value, "__code__", None)
+    if code is None:
         return inspect.isfunction(value)
-    return False
+    # Can't be a regular method, must be a static method
+    if code.co_argcount + code.co_kwonlyargcount == 0:
+        return True
+    # must be a regular method
+    if code.co_varnames and code.co_varnames[0] == "self":
+        return False
+    return inspect.isfunction(value)
+
+
+class _DefaultDict(dict):
+    """format_map 用的缺省字典，标题里出现但没有对应实参的占位符替换为空串"""
+
+    def __missing__(self, key):
+        return ""
+
+
+def _compile_title_template(raw_title, params):
+    """装饰时把 {{形参名}} 占位符编译成 str.format 模板，其余花括号全部转义"""
+    template = raw_title.replace("{", "{{").replace("}", "}}")
+    for name, _ in params:
+        template = template.replace("{{{{" + name + "}}}}", "{" + name + "}")
+    return template
+
+
+def _build_title(template, params, a, kw, offset):
+    """用调用实参渲染标题模板"""
+    substitutions = _DefaultDict()
+    # 实参序列化一次即可，不必在每个形参的循环里重复 represent
+    repr_args = [represent(x) for x in a] if ALLURE_STEP else None
+    # 获取方法的所有参数，并组装为 {形参：实参} 的字典
+    for index, (name, default) in enumerate(params):
+        argument = default
+        if repr_args:
+            try:
+                argument = repr_args[index + offset]
+            except IndexError:
+                pass
+        if kw:
+            try:
+                argument = kw[name]
+            except KeyError:
+                pass
+        if argument:
+            substitutions[name] = (
+                argument.strip("'") if isinstance(argument, str) else str(argument)
+            )
+        else:
+            substitutions[name] = ""
+    # 一次 C 层解析完成全部文本替换
+    return template.format_map(substitutions)
 
 
-def _trace(func):
+def _trace(func, klass=None):
     # pylint: disable=R0912
+    # 装饰时做一次签名的反射，避免每次调用重复 inspect 开销
+    # 所属类由 log(cls) 直接传入，免去 _findclass 对 sys.modules 的遍历
+    _is_init = func.__name__ == "__init__"
+    _root_logger = logging.getLogger()
+    _is_method = inspect.ismethod(func)
+    _is_static = is_static_method(klass, func.__name__) if klass else False
+    _signature = inspect.signature(func)
+    _has_self = "self" in _signature.parameters
+    _params = [
+        (param.name, param.default)
+        for param in _signature.parameters.values()
+        if param.name != "self"
+    ]
+    if func.__doc__:
+        # 处理多行注释时候，换行空格过多
+        _raw_title = _DOC_SPLIT_RE.split(func.__doc__)[0]
+        _raw_title = "".join([ln.strip() for ln in _raw_title.split("\n")])
+    else:
+        _raw_title = func.__name__
+    _title_template = _compile_title_template(_raw_title, _params)
+
     @wraps(func)
     def wrapped(*a, **kw):
+        # INFO 被过滤且不走 allure 步骤时，所有反射与标题处理都是白费，直接透传
+        if (
+                not ALLURE_STEP
+                and logging.root.handlers
+                and not _root_logger.isEnabledFor(logging.INFO)
+        ):
+            return func(*a, **kw)
+        if ALLURE_STEP and StepContext is None:
+            _load_allure()
+        offset = 0
         try:
             # 对象实例化后调用类方法报错处理
-            if (
-                    # pylint: disable=protected-access
-                    isinstance(a[0], inspect._findclass(func))
-                    and func.__name__ != "__init__"
-            ):
-                if func:
-                    if any(
-                            [
-                                inspect.ismethod(func),
-                                is_static_method(
-                                    # pylint: disable=protected-access
-                                    inspect._findclass(func),
-                                    func.__name__,
-                                ),
-                            ]
-                    ):
-                        a = list(a)[1:]
+            if klass is not None and isinstance(a[0], klass):
+                if not _is_init and any([_is_method, _is_static]):
+                    # 元组切片即可去掉实例，不必先转 list 多拷贝一次
+                    a = a[1:]
+                elif _has_self:
+                    # 实参中仍带着 self，取实参时索引需要后移一位
+                    offset = 1
         except IndexError:
             pass
         if func.__doc__:
             if not func.__name__.startswith("_"):
-                # 处理多行注释时候，换行空格过多
-                title = re.split(":param|@param|@return|:return", func.__doc__)[0]
-                title = "".join([ln.strip() for ln in title.split("\n")])
-                params_text = {}
-                # 获取方法的所有参数，并组装为 {形参：实参} 的字典
-                for index, param in enumerate(
-                        inspect.signature(func).parameters.values()
-                ):
-                    if param.name == "self":
-                        continue
-                    params_text[param.name] = param.default
-                    if ALLURE_STEP:
-                        args = list(map(lambda x: represent(x), a))
-                        if args:
-                            try:
-                                params_text[param.name] = args[index]
-                            except IndexError:
-                                pass
-                    if kw:
-                        try:
-                            params_text[param.name] = kw[param.name]
-                        except KeyError:
-                            pass
-                # 文本替换
-                for parameter, argument in params_text.items():
-                    if f"{parameter}" in title:
-                        if argument:
-                            title = title.replace(
-                                f"{{{{{parameter}}}}}",
-                                argument.strip("'")
-                                if isinstance(argument, str)
-                                else str(argument),
-                            )
-                        else:
-                            title = title.replace(f"{{{{{parameter}}}}}", "")
+                title = _build_title(_title_template, _params, a, kw, offset)
             else:
                 return func(*a, **kw)
         else:
-            title = func.__name__
-        logger.info(f"[{func.__name__}]: " f"{title}", auteadd=False)
-        if func.__name__ != "__init__":
-            if ALLURE_STEP:
-                params = func_parameters(func, *a, **kw)
-                with StepContext(title, params):
-                    return func(*a, **kw)
-        else:
+            title = _raw_title
+        logger.info("[%s]: %s", func.__name__, title, auteadd=False)
+        if _is_init or not ALLURE_STEP:
+            return func(*a, **kw)
+        params = func_parameters(func, *a, **kw)
+        with StepContext(title, params):
             return func(*a, **kw)
 
     return wrapped
@@ -167,58 +230,76 @@ def _trace(func):
 
 def log(cls):
     """类日志装饰器"""
-    for name, obj in inspect.getmembers(
-            cls, lambda x: inspect.isfunction(x) or inspect.ismethod(x)
-    ):
-        try:
-            class_name = obj.__qualname__.split(".")[0]
-        except AttributeError:
-            class_name = obj.__self__.__name__
+    # 类名分类只算一次，不符合过滤规则的类直接返回
+    class_name = cls.__name__
+    _startswith = tuple(config.CLASS_NAME_STARTSWITH)
+    _endswith = tuple(config.CLASS_NAME_ENDSWITH)
+    should_log = (
+            class_name.startswith(_startswith)
+            or class_name.endswith(_endswith)
+            or any((text in class_name for text in config.CLASS_NAME_CONTAIN))
+    )
+    if not should_log:
+        return cls
+    # 直接遍历 __dict__，省掉 getmembers 的全量 MRO 扫描和逐属性 getattr
+    for name, obj in list(cls.__dict__.items()):
         if name.startswith("_"):
             continue
-        if (
-                class_name.startswith(tuple(config.CLASS_NAME_STARTSWITH))
-                or class_name.endswith(tuple(config.CLASS_NAME_ENDSWITH))
-                or any(
-            (class_name.find(text) > -1 for text in config.CLASS_NAME_CONTAIN)
-        )
-        ):
-            if hasattr(getattr(cls, name), "__log"):
-                if not getattr(cls, name).__log:
-                    setattr(cls, name, _trace(obj))
-                    setattr(getattr(cls, name), "__log", True)
-            else:
-                setattr(cls, name, _trace(obj))
-                setattr(getattr(cls, name), "__log", True)
+        if isinstance(obj, (staticmethod, classmethod)):
+            # 与 getattr 的解包结果保持一致：静态方法取原函数，类方法取绑定方法
+            obj = getattr(cls, name)
+        elif not isinstance(obj, FunctionType):
+            continue
+        # 已包装过的方法直接跳过，避免二次包装
+        if getattr(obj, "__log", False):
+            continue
+        wrapped_fn = _trace(obj, klass=cls)
+        wrapped_fn.__log = True
+        setattr(cls, name, wrapped_fn)
     return cls
 
 
+def _color_enabled():
+    """仅在终端里且未设置 NO_COLOR 时才输出 ANSI 染色"""
+    return sys.stderr.isatty() and os.environ.get("NO_COLOR") is None
+
+
 class _ColoredFormatter(logging.Formatter):
+    # 各级别的 (染色级别名, 带[xx]前缀消息的替换模板, 纯文本消息的颜色)
+    _LEVEL_STYLES = {
+        "INFO": (  # 白色
+            "\033[1;97mINFO \033[0m",
+            r"\033[1;32m\1\033[0m\033[1;97m\2\033[0m",
+            "\033[1;97m",
+        ),
+        "ERROR": (  # 红色
+            "\033[1;31mERROR\033[0m",
+            r"\033[1;32m\1\033[0m\033[1;31m\2\033[0m",
+            "\033[1;31m",
+        ),
+        "DEBUG": (  # 蓝色
+            "\033[1;94mDEBUG\033[0m",
+            r"\033[1;32m\1\033[0m\033[1;94m\2\033[0m",
+            "\033[1;94m",
+        ),
+    }
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._use_color = _color_enabled()
+
     def formatMessage(self, record: logging.LogRecord) -> str:
-        if record.levelname == "INFO":
-            record.levelname = "\033[1;97mINFO \033[0m"  # 白色
-            record.message = re.sub(
-                r"(\[[a-zA-Z_]*?])?(.+)",
-                r"\033[1;32m\1\033[0m\033[1;97m\2\033[0m",
-                record.message,
-                count=1,
-            )
-        elif record.levelname == "ERROR":
-            record.levelname = "\033[1;31mERROR\033[0m"  # 红色
-            record.message = re.sub(
-                r"(\[[a-zA-Z_]*?])?(.+)",
-                r"\033[1;32m\1\033[0m\033[1;31m\2\033[0m",
-                record.message,
-                count=1,
-            )
-        elif record.levelname == "DEBUG":
-            record.levelname = "\033[1;94mDEBUG\033[0m"  # 蓝色
-            record.message = re.sub(
-                r"(\[[a-zA-Z_]*?])?(.+)",
-                r"\033[1;32m\1\033[0m\033[1;94m\2\033[0m",
-                record.message,
-                count=1,
-            )
+        # CI、重定向等非终端场景下染色只是浪费字节，直接走原始格式化
+        if not self._use_color:
+            return super().formatMessage(record)
+        style = self._LEVEL_STYLES.get(record.levelname)
+        if style:
+            record.levelname, repl, color = style
+            if "[" in record.message:
+                record.message = _COLOR_RE.sub(repl, record.message, count=1)
+            else:
+                # 没有[xx]前缀就不跑正则，直接整体染色
+                record.message = color + record.message + "\033[0m"
         message = super().formatMessage(record)
         return message
 
@@ -233,27 +314,21 @@ class logger(metaclass=Singleton):
 
     def __init__(self, level):
         """日志配置"""
+        global _initialized
         logging.root.handlers = []
         log_path = os.path.join(config.LOG_FILE_PATH, "logs")
         if not os.path.exists(log_path):
             os.makedirs(log_path)
-        log_path_debug = os.path.join(
-            log_path, f'{time.strftime("%Y-%m-%d", time.localtime())}_debug.log'
-        )
-        logfile_error = os.path.join(
-            log_path, f'{time.strftime("%Y-%m-%d", time.localtime())}_error.log'
-        )
-
-        if not os.path.exists(log_path_debug):
-            with open(log_path_debug, "w+", encoding="utf-8"):
-                pass
-        if not os.path.exists(logfile_error):
-            with open(logfile_error, "w+", encoding="utf-8"):
-                pass
-        try:
-            self.ip_end = re.findall(r"\d+.\d+.\d+.(\d+)", f"{config.HOST_IP}")[0]
+        _today = time.strftime("%Y-%m-%d", time.localtime())
+        log_path_debug = os.path.join(log_path, f"{_today}_debug.log")
+        logfile_error = os.path.join(log_path, f"{_today}_error.log")
+        Path(log_path_debug).touch()
+        Path(logfile_error).touch()
+        ip_match = _IP_RE.search(f"{config.HOST_IP}")
+        if ip_match:
+            self.ip_end = ip_match.group(1)
             self.ip_flag = f"-{self.ip_end}"
-        except IndexError:
+        else:
             self.ip_flag = ""
         self.sys_arch = config.SYS_ARCH
         self.date_format = "%m/%d %H:%M:%S"
@@ -264,22 +339,17 @@ class logger(metaclass=Singleton):
         self.logger = logging.getLogger()
         self.logger.setLevel(level)
         self.logger.addFilter(IgnoreFilter())
+        # 两个文件handler共用同一个格式器
+        file_formatter = logging.Formatter(
+            self.log_format,
+            datefmt=self.date_format,
+        )
         _fh = logging.FileHandler(log_path_debug, mode="w+")
         _fh.setLevel(logging.DEBUG)
         _fh.addFilter(IgnoreFilter())
-        _fh.setFormatter(
-            logging.Formatter(
-                self.log_format,
-                datefmt=self.date_format,
-            )
-        )
+        _fh.setFormatter(file_formatter)
         fh_error = logging.FileHandler(logfile_error, mode="w+")
-        _fh.setFormatter(
-            logging.Formatter(
-                self.log_format,
-                datefmt=self.date_format,
-            )
-        )
+        fh_error.setFormatter(file_formatter)
         # 输出到file的log等级的开关
         fh_error.setLevel(logging.ERROR)
         # 再创建一个handler，用于输出到控制台
@@ -287,63 +357,97 @@ class logger(metaclass=Singleton):
         # 输出到console的log等级的开关
         _ch.setLevel(level)
         _ch.addFilter(IgnoreFilter())
-        # 定义handler的输出格式
-        formatter = _ColoredFormatter(
-            (
+        # 定义handler的输出格式，非终端场景连前缀的转义码也一并省掉
+        if _color_enabled():
+            console_format = (
                 f"\033[1;31m{self.sys_arch}{self.ip_flag}\033[0m: "
                 "\033[93m%(asctime)s\033[0m | %(levelname)s | %(message)s"
-            ),
+            )
+        else:
+            console_format = self.log_format
+        formatter = _ColoredFormatter(
+            console_format,
             datefmt=self.date_format,
         )
         _ch.setFormatter(formatter)
-        # 将logger添加到handler里面
-        self.logger.addHandler(_fh)
-        self.logger.addHandler(fh_error)
-        self.logger.addHandler(_ch)
+        # 日志经队列异步写出，调用线程只做一次入队，磁盘IO由后台线程消化
+        log_queue = queue.SimpleQueue()
+        self.logger.addHandler(QueueHandler(log_queue))
+        self.listener = QueueListener(
+            log_queue, _fh, fh_error, _ch, respect_handler_level=True
+        )
+        self.listener.start()
+        atexit.register(self.listener.stop)
+        _initialized = True
 
     @staticmethod
-    def info(message, auteadd=True):
-        if len(logging.root.handlers) == 0:
-            logger(config.LOG_LEVEL)
+    def info(message, *args, auteadd=True):
+        if not _initialized:
+            _ensure_initialized()
+        # 帧回溯挪到级别判断之后，被过滤的日志不再付 _getframe 开销
+        if not logging.root.isEnabledFor(logging.INFO):
+            return
         if auteadd:
             current_frame = sys._getframe(1) if hasattr(sys, "_getframe") else None
-            message = f"[{current_frame.f_code.co_name}]: {message}"
-        logging.info(message)
+            if args:
+                # 调用方显式传了 *args 才把 message 当格式串拼接
+                message = "[%s]: " + message
+                args = (current_frame.f_code.co_name, *args)
+            else:
+                # 用户文本可能含 %，作为参数传入而不是进格式串
+                args = (current_frame.f_code.co_name, message)
+                message = "[%s]: %s"
+        logging.info(message, *args)
 
     @staticmethod
-    def debug(message, auteadd=True):
-        if len(logging.root.handlers) == 0:
-            logger(config.LOG_LEVEL)
+    def debug(message, *args, auteadd=True):
+        if not _initialized:
+            _ensure_initialized()
+        # debug 在用例直调时会升级成 info，所以以 INFO 作过滤下界
+        if not logging.root.isEnabledFor(logging.INFO):
+            return
         if auteadd:
             current_frame = sys._getframe(1) if hasattr(sys, "_getframe") else None
-            message = f"[{current_frame.f_code.co_name}]: {message}"
+            if args:
+                message = "[%s]: " + message
+                args = (current_frame.f_code.co_name, *args)
+            else:
+                args = (current_frame.f_code.co_name, message)
+                message = "[%s]: %s"
         # 判断是否用例直接调用底层基础方法，则输出info日志
         try:
             current_frame1 = sys._getframe(2) if hasattr(sys, "_getframe") else None
             if current_frame1.f_code.co_name.startswith("test_"):
-                logging.info(message)
+                logging.info(message, *args)
             else:
-                logging.debug(message)
+                logging.debug(message, *args)
         except ValueError:
-            logging.debug(message)
+            logging.debug(message, *args)
 
     @staticmethod
-    def error(message, auteadd=True):
-        if len(logging.root.handlers) == 0:
-            logger(config.LOG_LEVEL)
+    def error(message, *args, auteadd=True):
+        if not _initialized:
+            _ensure_initialized()
+        if not logging.root.isEnabledFor(logging.ERROR):
+            return
         if auteadd:
             current_frame = sys._getframe(1) if hasattr(sys, "_getframe") else None
-            message = f"[{current_frame.f_code.co_name}]: {message}"
-        logging.error(message)
+            if args:
+                message = "[%s]: " + message
+                args = (current_frame.f_code.co_name, *args)
+            else:
+                args = (current_frame.f_code.co_name, message)
+                message = "[%s]: %s"
+        logging.error(message, *args)
 
     @staticmethod
     def exception(message):
-        if len(logging.root.handlers) == 0:
-            logger(config.LOG_LEVEL)
+        if not _initialized:
+            _ensure_initialized()
         logging.exception(message)
 
     @staticmethod
     def warning(message):
-        if len(logging.root.handlers) == 0:
-            logger(config.LOG_LEVEL)
+        if not _initialized:
+            _ensure_initialized()
         logging.warning(message)